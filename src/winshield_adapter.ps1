@@ -133,6 +133,9 @@ foreach ($month in $MonthIds) {
 # OUTPUT
 # ------------------------------------------------------------
 
+# BOM-less UTF-8 for winshield_scanner.py
+[Console]::OutputEncoding = New-Object System.Text.UTF8Encoding $false
+
 [pscustomobject]@{
     ProductNameHint = $ProductNameHint
     MonthIds        = $MonthIds
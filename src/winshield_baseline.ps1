@@ -183,6 +183,9 @@ if ($msrcLatestMonthId) {
 # OUTPUT
 # ------------------------------------------------------------
 
+# BOM-less UTF-8 for winshield_scanner.py
+[Console]::OutputEncoding = New-Object System.Text.UTF8Encoding $false
+
 [pscustomobject]@{
     OsName            = $os.Caption
     OsEdition         = $cv.EditionID
@@ -5,14 +5,23 @@ Resolves and downloads a selected missing Windows update package
 from the Microsoft Update Catalog based on baseline constraints.
 """
 
-import json
+import hashlib
+import ntpath
 import os
 import re
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+import shutil
+import string
+from dataclasses import dataclass, field
+from email.message import Message
+from typing import Callable, Dict, List, Optional, Tuple
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError
+from urllib3.util.retry import Retry
+from lxml import etree
+from lxml import html as lhtml
 
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -31,7 +40,31 @@ CATALOG_BASE = "https://www.catalog.update.microsoft.com"
 SEARCH_URL = f"{CATALOG_BASE}/Search.aspx"
 DOWNLOAD_DIALOG_URL = f"{CATALOG_BASE}/DownloadDialog.aspx"
 
+CATALOG_ROWS_XPATH = "//table[@id='ctl00_catalogBody_updateMatches']//tr[contains(@id, '_R')]"
+
+# lxml rejects str input carrying an XML encoding declaration, so pages are
+# parsed as UTF-8 bytes with the encoding pinned.
+_CATALOG_PARSER = lhtml.HTMLParser(encoding="utf-8")
+
 DEFAULT_TIMEOUT = 30
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_RE_DV_HINT = re.compile(r"\b\d{2}h[12]\b")
+_RE_BUILD = re.compile(r"\(\s*(\d{5})\.")
+_RE_URL = re.compile(r"https?://[^\"]+\.(?:msu|cab)(?:\?[^\"]*)?", re.IGNORECASE)
+
+_GUID_CHARS = frozenset(string.hexdigits + "-")
+
+_FORBIDDEN_BY_ARCH: Dict[str, Tuple[str, ...]] = {
+    "x64": ("arm64-based", "x86-based", "32-bit"),
+    "arm64": ("x64-based", "x86-based", "32-bit"),
+    "x86": ("x64-based", "arm64-based"),
+}
+_REQUIRED_BY_ARCH: Dict[str, Tuple[str, ...]] = {
+    "x64": ("x64-based",),
+    "arm64": ("arm64-based",),
+    "x86": ("x86-based", "32-bit"),
+}
 
 
 @dataclass(frozen=True)
@@ -49,6 +82,10 @@ class CatalogCandidate:
     last_updated: str
     version: str
     size: str
+    title_lower: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "title_lower", self.title.lower())
 
 
 @dataclass(frozen=True)
@@ -64,8 +101,8 @@ def load_scan_result(path: str) -> dict:
     if not os.path.isfile(path):
         raise RuntimeError("Scan result not found. Run winshield_scanner.py first.")
 
-    with open(path, "r", encoding="utf-8") as handle:
-        return json.load(handle)
+    with open(path, "rb") as handle:
+        return orjson.loads(handle.read())
 
 
 def safe_input(prompt: str) -> str:
@@ -111,14 +148,28 @@ def build_constraints(baseline: dict) -> BaselineConstraints:
 
 
 def build_session() -> requests.Session:
-    """Create an HTTP session with stable headers."""
+    """Create a keep-alive HTTP session with stable headers and retries."""
     s = requests.Session()
     s.headers.update(
         {
             "User-Agent": "winshield-downloader",
             "Accept-Language": "en-GB,en;q=0.9",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
         }
     )
+
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=10,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
     return s
 
 
@@ -151,96 +202,102 @@ def build_missing_list(scan_result: dict) -> List[MissingKbItem]:
     return out
 
 
+def _cell_text(td: lhtml.HtmlElement) -> str:
+    """Join the stripped text fragments of a table cell with single spaces."""
+    texts = td.xpath(".//text()[not(ancestor::script) and not(ancestor::style)]")
+    return " ".join(t.strip() for t in texts if t.strip())
+
+
 def parse_search_candidates(html: str) -> List[CatalogCandidate]:
     """Parse Microsoft Update Catalog search results into structured candidates."""
 
-    soup = BeautifulSoup(html, "html.parser")
-    table = soup.find("table", id="ctl00_catalogBody_updateMatches")
-    if not table:
+    try:
+        doc = lhtml.fromstring(html.encode("utf-8"), parser=_CATALOG_PARSER)
+    except etree.ParserError:
         return []
 
     candidates: List[CatalogCandidate] = []
 
-    for tr in table.find_all("tr"):
+    for tr in doc.xpath(CATALOG_ROWS_XPATH):
         tr_id = (tr.get("id") or "").strip()
-        if "_R" not in tr_id:
-            continue
 
         update_id = tr_id.split("_R", 1)[0]
-        if not re.fullmatch(r"[0-9a-fA-F-]{36}", update_id):
+        if (
+            len(update_id) != 36
+            or update_id.count("-") != 4
+            or not _GUID_CHARS.issuperset(update_id)
+        ):
             continue
 
-        tds = tr.find_all("td")
+        tds = tr.xpath("./td")
         if len(tds) < 8:
             continue
 
         candidates.append(
             CatalogCandidate(
                 update_id=update_id,
-                title=tds[1].get_text(" ", strip=True),
-                products=tds[2].get_text(" ", strip=True),
-                classification=tds[3].get_text(" ", strip=True),
-                last_updated=tds[4].get_text(" ", strip=True),
-                version=tds[5].get_text(" ", strip=True),
-                size=tds[6].get_text(" ", strip=True),
+                title=_cell_text(tds[1]),
+                products=_cell_text(tds[2]),
+                classification=_cell_text(tds[3]),
+                last_updated=_cell_text(tds[4]),
+                version=_cell_text(tds[5]),
+                size=_cell_text(tds[6]),
             )
         )
 
     return candidates
 
 
-def score_candidate(candidate: CatalogCandidate, kb_id: str, c: BaselineConstraints) -> int:
-    """Score a catalog candidate against baseline constraints."""
+def make_scorer(kb_id: str, c: BaselineConstraints) -> Callable[[CatalogCandidate], int]:
+    """Build a candidate scoring function bound to a KB and baseline constraints."""
 
-    title = candidate.title.lower()
-    score = 0
+    kb_lower = kb_id.lower()
+    windows_gen = c.windows_gen
+    other_gen = {"windows 10": "windows 11", "windows 11": "windows 10"}.get(windows_gen)
+    reject_server = windows_gen.startswith("windows")
+    forbidden = _FORBIDDEN_BY_ARCH.get(c.catalog_arch, ())
+    required = _REQUIRED_BY_ARCH.get(c.catalog_arch, ())
+    dv = c.display_version.lower()
+    build_major = c.build_major
 
-    if kb_id.lower() not in title:
-        return -10_000
-    score += 50
+    def score_candidate(candidate: CatalogCandidate) -> int:
+        """Score a catalog candidate against the bound constraints."""
 
-    if c.windows_gen:
-        if c.windows_gen in title:
-            score += 40
-        if c.windows_gen == "windows 10" and "windows 11" in title:
-            return -10_000
-        if c.windows_gen == "windows 11" and "windows 10" in title:
+        title = candidate.title_lower
+        score = 0
+
+        if kb_lower not in title:
             return -10_000
+        score += 50
 
-    if c.windows_gen.startswith("windows") and "server" in title:
-        return -10_000
+        if windows_gen:
+            if windows_gen in title:
+                score += 40
+            if other_gen and other_gen in title:
+                return -10_000
 
-    if c.catalog_arch == "x64":
-        if any(x in title for x in ("arm64-based", "x86-based", "32-bit")):
+        if reject_server and "server" in title:
             return -10_000
-        if "x64-based" in title:
-            score += 25
 
-    elif c.catalog_arch == "arm64":
-        if any(x in title for x in ("x64-based", "x86-based", "32-bit")):
+        if any(x in title for x in forbidden):
             return -10_000
-        if "arm64-based" in title:
+        if any(x in title for x in required):
             score += 25
 
-    elif c.catalog_arch == "x86":
-        if any(x in title for x in ("x64-based", "arm64-based")):
-            return -10_000
-        if "x86-based" in title or "32-bit" in title:
-            score += 25
+        if dv:
+            if dv in title:
+                score += 25
+            if _RE_DV_HINT.search(title) and dv not in title:
+                score -= 15
 
-    dv = c.display_version.lower()
-    if dv:
-        if dv in title:
-            score += 25
-        if re.search(r"\b\d{2}h[12]\b", title) and dv not in title:
-            score -= 15
+        if build_major:
+            m = _RE_BUILD.search(title)
+            if m:
+                score += 10 if m.group(1) == build_major else -5
 
-    if c.build_major:
-        m = re.search(r"\(\s*(\d{5})\.", title)
-        if m:
-            score += 10 if m.group(1) == c.build_major else -5
+        return score
 
-    return score
+    return score_candidate
 
 
 def choose_best_candidate(
@@ -250,7 +307,8 @@ def choose_best_candidate(
 ) -> Tuple[Optional[CatalogCandidate], Optional[str]]:
     """Select the highest confidence candidate or return a reason for failure."""
 
-    scored = [(score_candidate(c, kb_id, constraints), c) for c in candidates]
+    scorer = make_scorer(kb_id, constraints)
+    scored = [(scorer(c), c) for c in candidates]
     scored = [(s, c) for s, c in scored if s >= 0]
 
     if not scored:
@@ -274,37 +332,78 @@ def build_dialog_params(update_id: str) -> dict:
 def extract_download_urls(html: str) -> List[str]:
     """Extract direct .msu or .cab URLs from download dialog HTML."""
 
-    urls = re.findall(
-        r"https?://[^\"]+\.(?:msu|cab)(?:\?[^\"]*)?",
-        html,
-        flags=re.IGNORECASE,
-    )
+    return list(dict.fromkeys(_RE_URL.findall(html)))
 
-    seen: set[str] = set()
-    out: List[str] = []
 
-    for u in urls:
-        if u not in seen:
-            seen.add(u)
-            out.append(u)
+class _HashingWriter:
+    """Write-only file wrapper that feeds every chunk to a hash object."""
+
+    def __init__(self, handle, digest) -> None:
+        self._handle = handle
+        self._digest = digest
+
+    def write(self, data: bytes) -> int:
+        self._digest.update(data)
+        return self._handle.write(data)
 
-    return out
 
+def resolve_filename(response: requests.Response, url: str) -> str:
+    """Prefer the server's Content-Disposition filename over the URL path.
 
-def download_file(session: requests.Session, url: str, out_dir: str) -> str:
-    """Download a resolved update package to disk."""
+    The header name is only used for .msu/.cab packages the installer can list,
+    and never when it contains ':' (an NTFS alternate data stream on Windows).
+    """
 
-    filename = url.split("/")[-1].split("?", 1)[0]
-    out_path = os.path.join(out_dir, filename)
+    disposition = response.headers.get("Content-Disposition")
+    if disposition:
+        msg = Message()
+        msg["Content-Disposition"] = disposition
+        # ntpath strips both separator styles so the name cannot escape out_dir.
+        name = ntpath.basename(msg.get_filename() or "").strip()
+        if name.lower().endswith((".msu", ".cab")) and ":" not in name:
+            return name
+
+    return url.split("/")[-1].split("?", 1)[0]
+
+
+def download_file(session: requests.Session, url: str, out_dir: str) -> Tuple[str, str]:
+    """Download a resolved update package to disk and return its path and SHA-256."""
 
     with session.get(url, stream=True, timeout=DEFAULT_TIMEOUT) as r:
         r.raise_for_status()
-        with open(out_path, "wb") as h:
-            for chunk in r.iter_content(chunk_size=1024 * 256):
-                if chunk:
-                    h.write(chunk)
+        r.raw.decode_content = True
+        length = int(r.headers.get("Content-Length") or 0)
+
+        out_path = os.path.join(out_dir, resolve_filename(r, url))
+        part_path = out_path + ".part"
+        digest = hashlib.sha256()
+
+        # Stream to a .part file so a failed transfer never leaves a package
+        # that looks complete in the downloads directory.
+        try:
+            with open(part_path, "wb") as h:
+                # Content-Length is the encoded size, so only preallocate identity bodies.
+                identity = length and not r.headers.get("Content-Encoding")
+                if identity:
+                    h.truncate(length)
+
+                try:
+                    shutil.copyfileobj(r.raw, _HashingWriter(h, digest), DOWNLOAD_CHUNK_SIZE)
+                except ProtocolError as exc:
+                    # Match the exception iter_content raised for truncated bodies.
+                    raise requests.exceptions.ChunkedEncodingError(exc) from exc
+
+                written = h.tell()
+                if identity and written != length:
+                    raise RuntimeError(f"Incomplete download: {written} of {length} bytes")
+                h.truncate()
+
+            os.replace(part_path, out_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
 
-    return out_path
+    return out_path, digest.hexdigest()
 
 
 def main() -> int:
@@ -354,8 +453,9 @@ def main() -> int:
         print("[!] No download URL found")
         return 1
 
-    out_path = download_file(session, urls[0], DOWNLOADS_DIR)
+    out_path, sha256 = download_file(session, urls[0], DOWNLOADS_DIR)
     print(f"[+] Downloaded to {out_path}")
+    print(f"[+] SHA256: {sha256}")
 
     return 0
 
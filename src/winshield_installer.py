@@ -19,6 +19,8 @@ DOWNLOADS_DIR = os.path.join(ROOT_DIR, "downloads")
 
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
+_RE_KB = re.compile(r"(KB\d{4,8})", re.IGNORECASE)
+
 
 def is_admin() -> bool:
     """Return True if the current process has administrative privileges."""
@@ -30,22 +32,19 @@ def is_admin() -> bool:
 
 def find_packages(path: str) -> List[str]:
     """Return a sorted list of .msu and .cab packages in the given directory."""
-    packages: List[str] = []
-
-    for name in os.listdir(path):
-        full = os.path.join(path, name)
-        if not os.path.isfile(full):
-            continue
-
-        if os.path.splitext(name)[1].lower() in (".msu", ".cab"):
-            packages.append(full)
+    with os.scandir(path) as it:
+        packages = [
+            e.path
+            for e in it
+            if e.is_file() and e.name.lower().endswith((".msu", ".cab"))
+        ]
 
     return sorted(packages, key=lambda p: os.path.basename(p).lower())
 
 
 def extract_kb_label(filename: str) -> str:
     """Extract a KB identifier from a filename if present."""
-    m = re.search(r"(KB\d{4,8})", filename, flags=re.IGNORECASE)
+    m = _RE_KB.search(filename)
     return m.group(1).upper() if m else filename
 
 
@@ -72,5 +72,7 @@ function Get-WinShieldInventory {
 # ------------------------------------------------------------
 
 if ($MyInvocation.InvocationName -ne '.') {
+    # BOM-less UTF-8 for winshield_scanner.py
+    [Console]::OutputEncoding = New-Object System.Text.UTF8Encoding $false
     Get-WinShieldInventory | ConvertTo-Json -Depth 3
 }
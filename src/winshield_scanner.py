@@ -5,18 +5,49 @@ Core engine that correlates installed Windows updates with MSRC CVRF data.
 Executes PowerShell collectors, resolves expected KBs, and determines patch posture.
 """
 
-import json
+import ctypes
 import os
+import re
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime
+from graphlib import CycleError, TopologicalSorter
 from typing import Dict, List, Set, Tuple
 
+import orjson
+
+try:
+    import winreg
+    import wmi
+except ImportError:
+    winreg = None
+    wmi = None
+
 
 BASELINE_SCRIPT = "winshield_baseline.ps1"
 INVENTORY_SCRIPT = "winshield_inventory.ps1"
 ADAPTER_SCRIPT = "winshield_adapter.ps1"
 
+ADAPTER_CHUNK_SIZE = 12
+ADAPTER_MAX_WORKERS = 4
+
+# Collect inventory in-process via WMI and the registry instead of powershell.exe.
+USE_NATIVE_COLLECTORS = True
+
+CBS_PACKAGES_KEY = r"SOFTWARE\Microsoft\Windows\CurrentVersion\Component Based Servicing\Packages"
+
+# CBS CurrentState values that mean the package payload is on the system:
+# Superseded (0x50), Installed (0x70) and Permanent (0x80).
+CBS_PRESENT_STATES = frozenset({0x50, 0x70, 0x80})
+
+TABLE_SEPARATOR = "-" * 110
+
+_RE_HOTFIX_KB = re.compile(r"^KB\d+$", re.IGNORECASE)
+_RE_PACKAGE_KB = re.compile(r"KB(\d{4,7})", re.IGNORECASE)
+
+_MONTH_ABBR = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(SCRIPT_DIR)
@@ -44,7 +75,7 @@ def run_powershell_script(script_name: str, extra_args: List[str] | None = None)
         *args,
     ]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = subprocess.run(cmd, capture_output=True)
 
     if result.returncode != 0:
         raise RuntimeError(f"{script_name} execution failed")
@@ -54,11 +85,98 @@ def run_powershell_script(script_name: str, extra_args: List[str] | None = None)
         raise RuntimeError(f"{script_name} returned no output")
 
     try:
-        return json.loads(stdout)
-    except json.JSONDecodeError as exc:
+        return orjson.loads(stdout)
+    except orjson.JSONDecodeError as exc:
         raise RuntimeError(f"{script_name} returned invalid JSON") from exc
 
 
+def is_admin() -> bool:
+    """Return True if the current process has administrative privileges."""
+    try:
+        return bool(ctypes.windll.shell32.IsUserAnAdmin())
+    except Exception:
+        return False
+
+
+def read_cbs_package_kbs() -> Set[str]:
+    """Return KB ids of CBS packages whose CurrentState marks them as present."""
+
+    package_kbs: Set[str] = set()
+
+    with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, CBS_PACKAGES_KEY) as key:
+        for i in range(winreg.QueryInfoKey(key)[0]):
+            name = winreg.EnumKey(key, i)
+            m = _RE_PACKAGE_KB.search(name)
+            if not m:
+                continue
+
+            # Absent, staged and pending packages leave keys behind; skip them.
+            try:
+                with winreg.OpenKey(key, name) as package:
+                    state = winreg.QueryValueEx(package, "CurrentState")[0]
+            except OSError:
+                continue
+
+            if state in CBS_PRESENT_STATES:
+                package_kbs.add(f"KB{m.group(1)}")
+
+    return package_kbs
+
+
+def collect_inventory_native() -> dict:
+    """Collect installed KBs in-process in the winshield_inventory.ps1 output shape.
+
+    Hotfixes come from Win32_QuickFixEngineering, the source behind Get-HotFix.
+    Package KBs come from the Component Based Servicing registry store that
+    Get-WindowsPackage enumerates, read only when elevated as in the script,
+    and limited to packages whose CurrentState is installed or superseded.
+    Unlike the script, package descriptions are not searched for KB ids,
+    because the registry store only exposes package identities.
+    A WMI failure propagates so the caller can fall back to PowerShell;
+    a registry failure leaves PackageKbs empty, as the script does.
+    """
+
+    admin = is_admin()
+
+    hotfix_kbs = sorted(
+        {
+            q.HotFixID.upper()
+            for q in wmi.WMI().Win32_QuickFixEngineering()
+            if q.HotFixID and _RE_HOTFIX_KB.match(q.HotFixID)
+        }
+    )
+
+    package_kbs: Set[str] = set()
+    if admin:
+        try:
+            package_kbs = read_cbs_package_kbs()
+        except OSError as exc:
+            print(f"[!] CBS package store unreadable, PackageKbs left empty: {exc}")
+
+    return {
+        "IsAdmin": admin,
+        "HotFixKbs": hotfix_kbs,
+        "PackageKbs": sorted(package_kbs),
+        "AllInstalledKbs": sorted(set(hotfix_kbs) | package_kbs),
+    }
+
+
+def collect_inventory() -> dict:
+    """Collect installed KBs natively when possible, else via PowerShell."""
+
+    if USE_NATIVE_COLLECTORS and wmi is not None:
+        try:
+            inventory = collect_inventory_native()
+            print("[+] Inventory source: native (WMI + CBS registry)")
+            return inventory
+        except Exception as exc:
+            print(f"[!] Native inventory failed, falling back to PowerShell: {exc}")
+
+    inventory = run_powershell_script(INVENTORY_SCRIPT)
+    print(f"[+] Inventory source: PowerShell ({INVENTORY_SCRIPT})")
+    return inventory
+
+
 def build_month_ids_from_lcu(baseline: dict, max_months: int = 48) -> List[str]:
     """Build a MonthId range from installed LCU up to the latest MSRC month."""
 
@@ -77,28 +195,16 @@ def build_month_ids_from_lcu(baseline: dict, max_months: int = 48) -> List[str]:
     )
 
     start = datetime.strptime(start_id, "%Y-%b").replace(day=1, tzinfo=UTC)
-    if start > end:
-        start = end
-
-    month_ids: List[str] = []
-    year, month = start.year, start.month
-
-    while True:
-        current = datetime(year, month, 1, tzinfo=UTC)
-        if current > end or len(month_ids) >= max_months:
-            break
-
-        month_ids.append(current.strftime("%Y-%b"))
 
-        if current == end:
-            break
+    # Work in absolute month indices so the range needs no datetime per month.
+    end_idx = end.year * 12 + end.month - 1
+    start_idx = min(start.year * 12 + start.month - 1, end_idx)
+    count = min(end_idx - start_idx + 1, max_months)
 
-        month += 1
-        if month == 13:
-            month = 1
-            year += 1
-
-    return month_ids
+    return [
+        f"{idx // 12}-{_MONTH_ABBR[idx % 12]}"
+        for idx in range(start_idx, start_idx + count)
+    ]
 
 
 def chunk_list(items: List[str], size: int) -> List[List[str]]:
@@ -106,7 +212,11 @@ def chunk_list(items: List[str], size: int) -> List[List[str]]:
 
 
 def merge_kb_entries(existing: Dict[str, dict], incoming: List[dict]) -> None:
-    """Merge adapter KB entries into an indexed structure."""
+    """Merge adapter KB entries into an indexed structure.
+
+    Months, Cves and Supersedes are accumulated as dicts used as ordered
+    sets; main() normalises them into sorted lists after merging.
+    """
 
     for entry in incoming:
         kb_id = entry.get("KB")
@@ -115,13 +225,50 @@ def merge_kb_entries(existing: Dict[str, dict], incoming: List[dict]) -> None:
 
         target = existing.setdefault(
             kb_id,
-            {"KB": kb_id, "Months": [], "Cves": [], "Supersedes": []},
+            {"KB": kb_id, "Months": {}, "Cves": {}, "Supersedes": {}},
         )
 
         for field in ("Months", "Cves", "Supersedes"):
             for value in entry.get(field) or []:
-                if value and value not in target[field]:
-                    target[field].append(value)
+                if value:
+                    target[field][value] = None
+
+
+def supersedence_closure(supersedes_map: Dict[str, Set[str]]) -> Dict[str, Set[str]]:
+    """Map each KB to every KB it transitively supersedes."""
+
+    closure: Dict[str, Set[str]] = {}
+
+    try:
+        order = list(TopologicalSorter(supersedes_map).static_order())
+    except CycleError:
+        order = []
+
+    if order:
+        # Superseded KBs are ordered first, so each node unions finished closures.
+        for kb_id in order:
+            reached: Set[str] = set()
+            for old in supersedes_map.get(kb_id, set()):
+                reached.add(old)
+                reached |= closure[old]
+            closure[kb_id] = reached
+        return closure
+
+    # Cyclic data has no topological order; walk each node independently.
+    for kb_id in supersedes_map:
+        reached = set()
+        stack = [kb_id]
+
+        while stack:
+            current = stack.pop()
+            for old in supersedes_map.get(current, set()):
+                if old not in reached:
+                    reached.add(old)
+                    stack.append(old)
+
+        closure[kb_id] = reached
+
+    return closure
 
 
 def compute_supersedence(
@@ -136,39 +283,27 @@ def compute_supersedence(
         for old in entry.get("Supersedes") or []:
             supersedes_map.setdefault(kb_id, set()).add(old)
 
+    closure = supersedence_closure(supersedes_map)
+
     logical_present = set(installed_kbs)
     superseded_by: Dict[str, Set[str]] = {}
 
     for root in installed_kbs:
-        stack = [root]
-        seen = {root}
-
-        while stack:
-            current = stack.pop()
-            for old in supersedes_map.get(current, set()):
-                logical_present.add(old)
-                superseded_by.setdefault(old, set()).add(root)
-                if old not in seen:
-                    seen.add(old)
-                    stack.append(old)
+        reached = closure.get(root, set())
+        logical_present |= reached
+        for old in reached:
+            superseded_by.setdefault(old, set()).add(root)
 
     return logical_present, {k: sorted(v) for k, v in superseded_by.items()}
 
 
 def print_kb_table(
-    kb_entries: List[dict],
+    kb_index: Dict[str, dict],
     installed_kbs: Set[str],
     logical_present_kbs: Set[str],
     superseded_by: Dict[str, List[str]],
 ) -> None:
-
-
-
-    kb_index: Dict[str, dict] = {}
-    for entry in kb_entries:
-        if entry.get("KB"):
-            kb_index[entry["KB"]] = entry
-
+    """Print the correlation table for indexed KB entries."""
 
     all_kbs = sorted(set(kb_index.keys()) | set(installed_kbs) | set(logical_present_kbs))
 
@@ -177,15 +312,15 @@ def print_kb_table(
     col_status_width = 40
     col_months_width = 20
 
-    print("=== Correlation ===")
-    print(
+    lines: List[str] = [
+        "=== Correlation ===",
         f"{'KB':<{col_kb_width}} "
         f"{'Type':<{col_type_width}} "
         f"{'Status':<{col_status_width}} "
         f"{'Months':<{col_months_width}} "
-        f"CVEs"
-    )
-    print("-" * 110)
+        f"CVEs",
+        TABLE_SEPARATOR,
+    ]
 
     for kb_id in all_kbs:
         entry = kb_index.get(kb_id)
@@ -224,7 +359,7 @@ def print_kb_table(
             month_cell = months[i] if i < len(months) else ""
             cve_cell = cves[i] if i < len(cves) else ""
 
-            print(
+            lines.append(
                 f"{kb_cell:<{col_kb_width}} "
                 f"{type_cell:<{col_type_width}} "
                 f"{status_cell:<{col_status_width}} "
@@ -232,7 +367,10 @@ def print_kb_table(
                 f"{cve_cell}"
             )
 
-        print("-" * 110)
+        lines.append(TABLE_SEPARATOR)
+
+    sys.stdout.write("\n".join(lines))
+    sys.stdout.write("\n")
 
 
 def main() -> None:
@@ -249,7 +387,7 @@ def main() -> None:
     print()
 
     print("[*] Collecting inventory...")
-    inventory = run_powershell_script(INVENTORY_SCRIPT)
+    inventory = collect_inventory()
     installed_kbs = set(inventory.get("AllInstalledKbs") or [])
     print(f"[+] Installed KBs: {len(installed_kbs)}")
     print()
@@ -263,19 +401,30 @@ def main() -> None:
     months_with_entries: List[str] = []
 
     print("[*] Querying MSRC...")
-    for chunk in chunk_list(month_ids, 3):
-        msrc_data = run_powershell_script(
-            ADAPTER_SCRIPT,
-            extra_args=[
-                "-MonthIds", ",".join(chunk),
-                "-ProductNameHint", product_name_hint,
-            ],
-        )
+    chunks = chunk_list(month_ids, ADAPTER_CHUNK_SIZE)
+
+    with ThreadPoolExecutor(max_workers=ADAPTER_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                run_powershell_script,
+                ADAPTER_SCRIPT,
+                [
+                    "-MonthIds", ",".join(chunk),
+                    "-ProductNameHint", product_name_hint,
+                ],
+            )
+            for chunk in chunks
+        ]
 
-        entries = msrc_data.get("KbEntries") or []
-        if entries:
-            months_with_entries.extend(chunk)
-            merge_kb_entries(merged, entries)
+        # Merge on the main thread in submission order to keep output deterministic.
+        for future in futures:
+            msrc_data = future.result()
+
+            entries = msrc_data.get("KbEntries") or []
+            if entries:
+                # Record the months the adapter reported, independent of chunk size.
+                months_with_entries.extend(m for e in entries for m in e.get("Months") or [])
+                merge_kb_entries(merged, entries)
 
     if not merged:
         print("[!] No KB data returned")
@@ -289,9 +438,11 @@ def main() -> None:
         e["Supersedes"] = sorted(set(e.get("Supersedes") or []))
         e["UpdateType"] = "Superseding" if e["Supersedes"] else "Standalone"
 
+    kb_by_id: Dict[str, dict] = {e["KB"]: e for e in kb_entries}
+
     logical_present, superseded_by = compute_supersedence(kb_entries, installed_kbs)
 
-    expected = {e["KB"] for e in kb_entries}
+    expected = set(kb_by_id)
     missing = sorted(expected - logical_present)
 
     print()
@@ -301,7 +452,7 @@ def main() -> None:
     print()
 
     print_kb_table(
-        kb_entries=kb_entries,
+        kb_index=kb_by_id,
         installed_kbs=installed_kbs,
         logical_present_kbs=logical_present,
         superseded_by=superseded_by,
@@ -313,7 +464,7 @@ def main() -> None:
         print("None")
     else:
         for kb in missing:
-            entry = next((e for e in kb_entries if e.get("KB") == kb), {})
+            entry = kb_by_id.get(kb, {})
             months = ", ".join(entry.get("Months") or [])
             cve_count = len(entry.get("Cves") or [])
             print(f"- {kb} | Months: {months}, CVEs: {cve_count}")
@@ -327,8 +478,8 @@ def main() -> None:
         "MissingKbs": missing,
     }
 
-    with open(SCAN_RESULT_PATH, "w", encoding="utf-8") as h:
-        json.dump(result, h, indent=2)
+    with open(SCAN_RESULT_PATH, "wb") as h:
+        h.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
 
     print()
     print(f"[+] Saved scan result to {SCAN_RESULT_PATH}")